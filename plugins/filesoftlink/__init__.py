@@ -1,28 +1,38 @@
-import datetime
 import os
+import queue
 import re
 import shutil
+import stat
 import threading
+import time
 import traceback
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from typing import Dict, Any, Optional
 
-import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import FileSystemEventHandler, FileCreatedEvent, DirCreatedEvent, FileMovedEvent, \
+    DirMovedEvent, FileDeletedEvent, DirDeletedEvent, FileClosedEvent
 from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
 
+try:
+    from watchdog.observers.inotify import InotifyObserver
+except Exception:
+    # 非Linux系统无inotify
+    InotifyObserver = None
+
 from app import schemas
-from app.core.config import settings
 from app.core.event import eventmanager, Event
 from app.log import logger
 from app.plugins import _PluginBase
 from app.schemas.types import EventType, MediaType, SystemConfigKey
 from app.utils.system import SystemUtils
 
-lock = threading.Lock()
+# 需要软链接的媒体文件后缀
+_MEDIA_EXTS = frozenset(ext.lower() for ext in MediaType.ALL_VIDEO + MediaType.ALL_SUBTITLE)
 
 
 class FileMonitorHandler(FileSystemEventHandler):
@@ -30,22 +40,44 @@ class FileMonitorHandler(FileSystemEventHandler):
     目录监控响应类
     """
 
-    def __init__(self, monpath: str, sync: Any, **kwargs):
+    def __init__(self, monpath: str, sync: Any, close_events: bool = False, **kwargs):
         super(FileMonitorHandler, self).__init__(**kwargs)
         self._watch_path = monpath
         self.sync = sync
+        # 监控器是否提供写入完成（IN_CLOSE_WRITE）事件
+        self._close_events = close_events
 
     def on_created(self, event):
-        self.sync.event_handler(event=event, text="创建",
-                                mon_path=self._watch_path, event_path=event.src_path)
+        # 目录本身不处理，目录中的文件会产生各自的事件
+        if event.is_directory:
+            return
+        delay = None
+        if self._close_events:
+            # 空文件可能是正在写入的新文件，延后处理，期间的写入完成事件会覆盖本次事件；
+            # 从监控目录外移入的文件同样产生创建事件但没有写入完成事件，空文件仍会在延后后处理
+            try:
+                if os.path.getsize(event.src_path) == 0:
+                    delay = self.sync.create_delay
+            except OSError:
+                return
+        self.sync.enqueue_event(text="创建", mon_path=self._watch_path, event_path=event.src_path, delay=delay)
+
+    def on_modified(self, event):
+        # 轮询监控没有写入完成事件，以修改事件代替
+        if self._close_events or event.is_directory:
+            return
+        self.sync.enqueue_event(text="修改", mon_path=self._watch_path, event_path=event.src_path)
+
+    def on_closed(self, event):
+        self.sync.enqueue_event(text="写入", mon_path=self._watch_path, event_path=event.src_path)
 
     def on_moved(self, event):
-        self.sync.event_handler(event=event, text="移动",
-                                mon_path=self._watch_path, event_path=event.dest_path)
+        if event.is_directory:
+            return
+        self.sync.enqueue_event(text="移动", mon_path=self._watch_path, event_path=event.dest_path)
 
     def on_deleted(self, event):
-        self.sync.event_handler(event=event, text="删除",
-                                mon_path=self._watch_path, event_path=event.src_path)
+        self.sync.enqueue_event(text="删除", mon_path=self._watch_path, event_path=event.src_path)
 
 
 class FileSoftLink(_PluginBase):
@@ -56,7 +88,7 @@ class FileSoftLink(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/thsrite/MoviePilot-Plugins/main/icons/softlink.png"
     # 插件版本
-    plugin_version = "1.0"
+    plugin_version = "1.1"
     # 插件作者
     plugin_author = "nic"
     # 作者主页
@@ -69,7 +101,8 @@ class FileSoftLink(_PluginBase):
     auth_level = 1
 
     # 私有属性
-    _scheduler = None
+    # 延迟启动任务
+    _timers = []
     _observer = []
     _enabled = False
     _onlyonce = False
@@ -78,17 +111,67 @@ class FileSoftLink(_PluginBase):
     _size = 0
     # 模式 compatibility/fast
     _mode = "compatibility"
+    # 兼容模式下网络目录的轮询间隔（秒）
+    _poll_interval = 30
+    # 全量同步并发线程数
+    _sync_workers = 8
     _monitor_dirs = ""
     _exclude_keywords = ""
+    _exclude_re: Optional[re.Pattern] = None
     # 存储源目录与目的目录关系
     _dirconf: Dict[str, Optional[Path]] = {}
+    # 所有目的目录的路径前缀（以分隔符结尾），用于跳过媒体库目录中的文件
+    _target_prefixes: tuple = ()
     _medias = {}
     # 退出事件
     _event = threading.Event()
+    # 事件去抖队列及处理线程
+    _event_queue: Optional[queue.Queue] = None
+    _event_worker: Optional[threading.Thread] = None
+    # 事件处理线程数，不同路径的事件并行处理
+    _event_workers = 4
+    # 同一路径事件合并窗口（秒）
+    _debounce_delay = 0.3
+    # inotify下新建空文件等待写入完成事件的时间（秒）
+    create_delay = 5
+    # 同步汇总日志间隔（秒）及期间同步的文件数
+    _summary_interval = 60
+    _synced_count = 0
+    _synced_lock = threading.Lock()
+    # 按监控目录分片的事件锁，不同监控目录的事件互不阻塞
+    _locks = [threading.Lock() for _ in range(16)]
+    # 按目标文件加锁，避免同一文件的并发操作
+    _file_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+    _file_locks_guard = threading.Lock()
+    # 已创建的目的目录（LRU），避免每个文件重复mkdir
+    _mkdir_cache: "OrderedDict[str, None]" = OrderedDict()
+    _mkdir_cache_size = 4096
+    _mkdir_lock = threading.Lock()
+    # 最近已同步的文件（LRU），(源文件路径, 目标文件路径) -> (mtime_ns, size)，用于跳过重复事件
+    _recent_synced: "OrderedDict[tuple, tuple]" = OrderedDict()
+    _recent_synced_size = 8192
+    _recent_lock = threading.Lock()
+    # 目的目录文件描述符缓存（LRU），目录 -> [fd, 引用计数, (st_dev, st_ino)]，软链接操作只需解析文件名
+    _dir_fds: "OrderedDict[str, list]" = OrderedDict()
+    _dir_fds_size = 256
+    _dir_fds_lock = threading.Lock()
+    _use_dir_fd = os.symlink in os.supports_dir_fd and os.rename in os.supports_dir_fd \
+        and os.unlink in os.supports_dir_fd
+    # inotify监控订阅的事件类型
+    _inotify_events = [FileCreatedEvent, DirCreatedEvent, FileMovedEvent, DirMovedEvent,
+                       FileDeletedEvent, DirDeletedEvent, FileClosedEvent]
+    # 需要轮询监控的网络/FUSE文件系统类型
+    _remote_fstypes = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse", "9p",
+                       "sshfs", "davfs", "ceph", "glusterfs", "afs", "ncpfs")
 
     def init_plugin(self, config: dict = None):
         # 清空配置
         self._dirconf = {}
+        self._target_prefixes = ()
+        with self._mkdir_lock:
+            self._mkdir_cache.clear()
+        with self._recent_lock:
+            self._recent_synced.clear()
 
         # 读取配置
         if config:
@@ -100,13 +183,27 @@ class FileSoftLink(_PluginBase):
             self._exclude_keywords = config.get("exclude_keywords") or ""
             self._cron = config.get("cron")
             self._size = config.get("size") or 0
+            self._poll_interval = int(config.get("poll_interval") or 30)
+            self._sync_workers = int(config.get("sync_workers") or 8)
+
+        # 预编译排除关键字
+        self._exclude_re = None
+        if self._exclude_keywords:
+            try:
+                self._exclude_re = re.compile(self._exclude_keywords, re.IGNORECASE)
+            except re.error as e:
+                logger.warn(f"排除关键字 {self._exclude_keywords} 不是有效的正则表达式：{str(e)}")
 
         # 停止现有任务
         self.stop_service()
+        self._event.clear()
 
         if self._enabled or self._onlyonce:
-            # 定时服务管理器
-            self._scheduler = BackgroundScheduler(timezone=settings.TZ)
+            # 事件去抖处理线程
+            if self._enabled:
+                self._event_queue = queue.Queue()
+                self._event_worker = threading.Thread(target=self.__event_worker, daemon=True)
+                self._event_worker.start()
 
             # 读取目录配置
             monitor_dirs = self._monitor_dirs.split("\n")
@@ -150,44 +247,49 @@ class FileSoftLink(_PluginBase):
 
                     # 异步开启云盘监控
                     logger.info(f"异步开启实时硬链接 {mon_path} {self._mode}，延迟5s启动")
-                    self._scheduler.add_job(func=self.start_monitor, trigger='date',
-                                            run_date=datetime.datetime.now(
-                                                tz=pytz.timezone(settings.TZ)) + datetime.timedelta(seconds=5),
-                                            name=f"实时硬链接 {mon_path}",
-                                            kwargs={
-                                                "source_dir": mon_path
-                                            })
+                    self.__start_timer(5, self.start_monitor, kwargs={
+                        "source_dir": mon_path
+                    })
+
+            self._target_prefixes = tuple(str(p).rstrip(os.sep) + os.sep for p in self._dirconf.values() if p)
 
             # 运行一次定时服务
             if self._onlyonce:
                 logger.info("实时软连接服务启动，立即运行一次")
-                self._scheduler.add_job(name="实时软连接", func=self.sync_all, trigger='date',
-                                        run_date=datetime.datetime.now(
-                                            tz=pytz.timezone(settings.TZ)) + datetime.timedelta(seconds=3)
-                                        )
+                self.__start_timer(3, self.sync_all)
                 # 关闭一次性开关
                 self._onlyonce = False
                 # 保存配置
                 self.__update_config()
 
-            # 启动定时服务
-            if self._scheduler.get_jobs():
-                self._scheduler.print_jobs()
-                self._scheduler.start()
+    def __start_timer(self, delay: float, func, kwargs: dict = None):
+        """
+        延迟执行一次任务
+        """
+        timer = threading.Timer(delay, func, kwargs=kwargs)
+        timer.daemon = True
+        timer.start()
+        self._timers.append(timer)
 
     def start_monitor(self, source_dir: str):
         """
         异步开启实时软链接
         """
         try:
-            if str(self._mode) == "compatibility":
-                # 兼容模式，目录同步性能降低且NAS不能休眠，但可以兼容挂载的远程共享目录如SMB
-                observer = PollingObserver(timeout=10)
-            else:
-                # 内部处理系统操作类型选择最优解
-                observer = Observer(timeout=10)
+            observer = self._pick_observer(source_dir)
             self._observer.append(observer)
-            observer.schedule(FileMonitorHandler(source_dir, self), path=source_dir, recursive=True)
+            close_events = InotifyObserver is not None and isinstance(observer, InotifyObserver)
+            handler = FileMonitorHandler(source_dir, self, close_events=close_events)
+            if close_events:
+                try:
+                    # 只订阅需要的inotify事件，忽略读写过程中的大量IN_MODIFY/IN_OPEN等事件
+                    observer.schedule(handler, path=source_dir, recursive=True,
+                                      event_filter=self._inotify_events)
+                except TypeError:
+                    # watchdog 4.0 以下不支持event_filter
+                    observer.schedule(handler, path=source_dir, recursive=True)
+            else:
+                observer.schedule(handler, path=source_dir, recursive=True)
             observer.daemon = True
             observer.start()
             logger.info(f"{source_dir} 的实时软链接服务启动")
@@ -205,6 +307,47 @@ class FileSoftLink(_PluginBase):
                 logger.error(f"{source_dir} 启动云盘监控失败：{err_msg}")
             self.systemmessage.put(f"{source_dir} 启动云盘监控失败：{err_msg}")
 
+    def _pick_observer(self, path: str):
+        """
+        按目录所在文件系统选择监控方式：本地文件系统使用inotify等系统事件，网络/FUSE挂载使用轮询
+        """
+        if str(self._mode) != "compatibility":
+            # 内部处理系统操作类型选择最优解
+            return Observer(timeout=10)
+        fstype = self.__get_fstype(path)
+        if fstype and fstype.split(".")[0] not in self._remote_fstypes:
+            logger.info(f"{path} 位于本地文件系统 {fstype}，使用系统事件监控")
+            return Observer(timeout=10)
+        # 兼容模式，目录同步性能降低且NAS不能休眠，但可以兼容挂载的远程共享目录如SMB
+        logger.info(f"{path} 位于网络或未知文件系统 {fstype}，使用轮询监控，间隔{self._poll_interval}s")
+        return PollingObserver(timeout=self._poll_interval)
+
+    @staticmethod
+    def __get_fstype(path: str) -> Optional[str]:
+        """
+        从 /proc/self/mountinfo 中查找目录所在挂载点的文件系统类型，无法识别时返回None
+        """
+        try:
+            real_path = os.path.realpath(path)
+            fstype, mount_len = None, -1
+            with open("/proc/self/mountinfo", encoding="utf-8") as f:
+                for line in f:
+                    fields = line.split(" - ", 1)
+                    if len(fields) != 2:
+                        continue
+                    # 挂载点中的空格等字符以八进制转义
+                    mount_point = re.sub(r"\\(\d{3})", lambda m: chr(int(m.group(1), 8)),
+                                         fields[0].split()[4])
+                    if mount_point != "/" and real_path != mount_point \
+                            and not real_path.startswith(mount_point.rstrip("/") + "/"):
+                        continue
+                    if len(mount_point) >= mount_len:
+                        fstype, mount_len = fields[1].split()[0], len(mount_point)
+            return fstype
+        except Exception as e:
+            logger.debug(f"{path} 获取文件系统类型失败：{str(e)}")
+            return None
+
     def __update_config(self):
         """
         更新配置
@@ -217,7 +360,9 @@ class FileSoftLink(_PluginBase):
             "monitor_dirs": self._monitor_dirs,
             "exclude_keywords": self._exclude_keywords,
             "cron": self._cron,
-            "size": self._size
+            "size": self._size,
+            "poll_interval": self._poll_interval,
+            "sync_workers": self._sync_workers
         })
 
     @eventmanager.register(EventType.PluginAction)
@@ -241,98 +386,434 @@ class FileSoftLink(_PluginBase):
         """
         立即运行一次，全量同步目录中所有文件
         """
+        # 全量同步需重新校验目标文件，不使用最近同步记录
+        with self._recent_lock:
+            self._recent_synced.clear()
+        workers = self._sync_workers or 8
         for mon_path, target_path in self._dirconf.items():
             logger.info(f"开始同步监控目录：{mon_path}")
-            for path in Path(mon_path).rglob('*'):
-                if path.is_file():
-                    self.__handle_file(path, mon_path, target_path)
+            synced_count = 0
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = set()
+                for entry in self._walk_files(mon_path):
+                    # 限制排队任务数，避免大目录一次性提交所有文件
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        synced_count += sum(f.result() for f in done)
+                    pending.add(executor.submit(self.__sync_file, entry.path, mon_path, target_path))
+                synced_count += sum(f.result() for f in pending)
+            logger.info(f"监控目录 {mon_path} 同步完成，共同步 {synced_count} 个文件")
+
+    def __sync_file(self, src: str, mon_path: str, target_path: Path) -> bool:
+        """
+        全量同步线程池中处理单个文件，异常只记录不中断同步
+        """
+        try:
+            return self.__handle_file(src, os.path.relpath(src, mon_path), target_path)
+        except Exception as e:
+            logger.error(f"{src} 同步失败：{str(e)}")
+            return False
+
+    @staticmethod
+    def _walk_files(root: str):
+        """
+        遍历目录下所有文件（含指向文件的软链接），使用scandir返回的文件类型避免逐个stat
+        """
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry
+            except OSError as e:
+                logger.warn(f"读取目录 {current} 失败：{str(e)}")
+
+    def enqueue_event(self, text: str, mon_path: str, event_path: str, delay: Optional[float] = None):
+        """
+        监控事件入队，由处理线程去抖后统一处理
+        :param delay: 延迟处理的秒数，默认为去抖窗口
+        """
+        if self._event_queue:
+            self._event_queue.put((event_path, text, mon_path,
+                                   time.monotonic() + (self._debounce_delay if delay is None else delay)))
+
+    def __event_worker(self):
+        """
+        事件去抖线程，同一监控目录下同一路径在去抖窗口内的多次事件只处理最后一次；
+        到期的事件交由线程池并行处理，同一路径同时只处理一个事件以保证先后顺序
+        """
+        # (事件路径, 监控目录) -> (事件类型, 截止时间)，嵌套的监控目录会对同一路径各自产生事件
+        pending: Dict[tuple, tuple] = {}
+        # 正在处理的事件
+        running = set()
+        running_lock = threading.Lock()
+
+        def done(key: tuple):
+            with running_lock:
+                running.discard(key)
+
+        last_summary = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self._event_workers) as executor:
+            while not self._event.is_set():
+                timeout = 1
+                if pending:
+                    # 到期但同一路径仍在处理的事件需稍后重试
+                    timeout = min(timeout, max(0.05, min(p[1] for p in pending.values()) - time.monotonic()))
+                try:
+                    event_path, text, mon_path, deadline = self._event_queue.get(timeout=timeout)
+                    pending[(event_path, mon_path)] = (text, deadline)
+                except queue.Empty:
+                    pass
+                now = time.monotonic()
+                for key, (text, deadline) in list(pending.items()):
+                    if deadline > now:
+                        continue
+                    with running_lock:
+                        if key in running:
+                            continue
+                        running.add(key)
+                    del pending[key]
+                    future = executor.submit(self.event_handler, event=None, text=text,
+                                             mon_path=key[1], event_path=key[0])
+                    future.add_done_callback(lambda _, k=key: done(k))
+                # 定期输出同步汇总
+                if now - last_summary >= self._summary_interval:
+                    last_summary = now
+                    with self._synced_lock:
+                        synced_count, self._synced_count = self._synced_count, 0
+                    if synced_count:
+                        logger.info(f"最近{self._summary_interval}秒共同步 {synced_count} 个文件")
 
     def event_handler(self, event, text, mon_path, event_path):
         """
         事件处理
         """
-        with lock:
-            try:
-                logger.info(f"{event_path} {text}事件")
-                # 跳过云盘临时文件
-                if not Path(event_path).exists() and text != "删除":
-                    return
+        try:
+            # 锁内只做校验并确定目标，文件操作在锁外进行，同一目标文件由文件锁保护
+            with self._locks[hash(mon_path) % len(self._locks)]:
+                logger.debug(f"{event_path} {text}事件")
+                st = None
+                if text != "删除":
+                    # 跳过云盘临时文件
+                    try:
+                        st = os.stat(event_path)
+                    except FileNotFoundError:
+                        return
+                    # 跳过目录，避免在目的目录中创建指向源目录的软链接
+                    if stat.S_ISDIR(st.st_mode):
+                        return
                 # 跳过大于指定大小的文件
-                if self._size > 0 and Path(event_path).exists() and os.path.getsize(event_path) > self._size * 1024 * 1024:
+                if self._size > 0 and st and st.st_size > self._size * 1024 * 1024:
                     logger.info(f"{event_path} 文件大小超过限制，跳过")
                     return
 
                 # 跳过排除的文件或目录
-                if self._exclude_keywords and re.findall(self._exclude_keywords, event_path, re.IGNORECASE):
+                if self._exclude_re and self._exclude_re.search(event_path):
                     logger.info(f"{event_path} 匹配排除关键字，跳过")
                     return
 
-                # 软链接或复制文件
-                if text == "删除":
-                    self.__handle_delete(event_path, mon_path)
-                else:
-                    self.__handle_file(event_path, mon_path, self._dirconf.get(mon_path))
+                relpath = os.path.relpath(event_path, mon_path)
+                target_path = self._dirconf.get(mon_path)
 
-            except Exception as e:
-                logger.error(f"{event_path} {text}事件处理失败：{str(e)}")
-                self.systemmessage.put(f"{event_path} {text}事件处理失败：{str(e)}")
+            # 软链接或复制文件
+            if text == "删除":
+                self.__forget_synced(event_path)
+                self.__handle_delete(relpath, target_path)
+            else:
+                if self.__handle_file(event_path, relpath, target_path, st=st):
+                    with self._synced_lock:
+                        self._synced_count += 1
 
-    def __handle_file(self, path: Path, mon_path: str, target_path: Path):
+        except Exception as e:
+            logger.error(f"{event_path} {text}事件处理失败：{str(e)}")
+            self.systemmessage.put(f"{event_path} {text}事件处理失败：{str(e)}")
+
+    def __handle_file(self, src: str, rel: str, target_path: Path,
+                      st: Optional[os.stat_result] = None) -> bool:
         """
         同步单个文件，创建软链接或复制文件
+        :param src: 源文件路径
+        :param rel: 源文件相对监控目录的路径
+        :param target_path: 目的目录
+        :param st: 调用方已获取的文件状态
+        :return: 是否新建或更新了目标文件
         """
         # 跳过排除的文件或目录
-        if not path.exists():
-            return
+        if st is None:
+            try:
+                st = os.stat(src)
+            except FileNotFoundError:
+                return False
 
         # 跳过媒体库目录
-        if any([p in str(path) for p in self._dirconf.values() if p]):
-            return
+        if src.startswith(self._target_prefixes):
+            return False
+
+        # 文件未变化且最近已同步到该目标
+        target_file = target_path.joinpath(rel)
+        key = (src, str(target_file))
+        with self._recent_lock:
+            if self._recent_synced.get(key) == (st.st_mtime_ns, st.st_size):
+                self._recent_synced.move_to_end(key)
+                return False
 
         # 创建目的目录
-        relpath = path.relative_to(mon_path)
-        target_file = target_path.joinpath(relpath)
-        target_dir = target_file.parent
-        target_dir.mkdir(parents=True, exist_ok=True)
+        self.__ensure_dir(target_file.parent)
+
+        copy = self._copy_files and os.path.splitext(src)[1].lower() not in _MEDIA_EXTS
+        with self.__file_lock(target_file):
+            # 目标文件已是最新则跳过
+            if self.__is_synced(src, target_file, st, copy):
+                self.__remember_synced(key, st)
+                return False
+            self.__replace_file(src, target_file, copy=copy)
+            if copy:
+                logger.debug(f"已复制文件 {src} 到 {target_file}")
+            elif self._copy_files:
+                logger.debug(f"已为媒体文件 {src} 创建软链接 {target_file}")
+            else:
+                logger.debug(f"已为文件 {src} 创建软链接 {target_file}")
+        self.__remember_synced(key, st)
+        return True
+
+    def __remember_synced(self, key: tuple, st: os.stat_result):
+        """
+        记录已同步的源文件状态，key为(源文件路径, 目标文件路径)
+        """
+        with self._recent_lock:
+            self._recent_synced[key] = (st.st_mtime_ns, st.st_size)
+            self._recent_synced.move_to_end(key)
+            if len(self._recent_synced) > self._recent_synced_size:
+                self._recent_synced.popitem(last=False)
 
-        if target_file.exists():
-            target_file.unlink()
+    def __forget_synced(self, path: str):
+        """
+        移除该路径及其子路径的同步记录
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._recent_lock:
+            for key in [key for key in self._recent_synced if key[0] == path or key[0].startswith(prefix)]:
+                del self._recent_synced[key]
 
-        if self._copy_files:
-            if path.suffix.lower() in MediaType.ALL_VIDEO + MediaType.ALL_SUBTITLE:
-                os.symlink(path, target_file)
-                logger.info(f"已为媒体文件 {path} 创建软链接 {target_file}")
-            else:
-                shutil.copy(path, target_file)
-                logger.info(f"已复制文件 {path} 到 {target_file}")
-        else:
-            os.symlink(path, target_file)
-            logger.info(f"已为文件 {path} 创建软链接 {target_file}")
+    @staticmethod
+    def __is_synced(src: str, target_file: Path, st: os.stat_result, copy: bool) -> bool:
+        """
+        判断目标文件是否已同步：软链接指向源文件，或复制文件大小及修改时间与源文件一致
+        """
+        try:
+            if copy:
+                target_st = os.stat(target_file, follow_symlinks=False)
+                return target_st.st_size == st.st_size and target_st.st_mtime_ns == st.st_mtime_ns
+            return os.readlink(target_file) == src
+        except OSError:
+            return False
+
+    def __replace_file(self, src: str, target_file: Path, copy: bool):
+        """
+        先在临时文件上创建软链接或复制，再原子替换目标文件，避免中途失败时目标文件缺失
+        """
+        tmp_file = target_file.with_name(f"{target_file.name}.tmp{os.getpid()}")
+        if copy:
+            try:
+                # 上次异常退出残留的临时文件可能是指向源文件的软链接，必须先删除，不能写入
+                tmp_file.unlink(missing_ok=True)
+                self._fast_copy(src, tmp_file)
+                os.replace(tmp_file, target_file)
+            except Exception as e:
+                tmp_file.unlink(missing_ok=True)
+                if isinstance(e, FileNotFoundError):
+                    # 目的目录已被外部删除，清除缓存以便下次重新创建
+                    self.__invalidate_dirs(target_file.parent)
+                raise
+            return
+
+        try:
+            with self.__dir_fd(str(target_file.parent)) as dir_fd:
+                # 不支持dir_fd时使用完整路径
+                if dir_fd is None:
+                    tmp_name, target_name = str(tmp_file), str(target_file)
+                else:
+                    tmp_name, target_name = tmp_file.name, target_file.name
+                try:
+                    try:
+                        os.symlink(src, tmp_name, dir_fd=dir_fd)
+                    except FileExistsError:
+                        # 上次异常退出残留的临时文件
+                        os.unlink(tmp_name, dir_fd=dir_fd)
+                        os.symlink(src, tmp_name, dir_fd=dir_fd)
+                    os.replace(tmp_name, target_name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+                except Exception:
+                    try:
+                        os.unlink(tmp_name, dir_fd=dir_fd)
+                    except FileNotFoundError:
+                        pass
+                    raise
+        except FileNotFoundError:
+            # 目的目录已被外部删除，清除缓存以便下次重新创建
+            self.__invalidate_dirs(target_file.parent)
+            raise
+
+    @contextmanager
+    def __dir_fd(self, target_dir: str):
+        """
+        获取目的目录的文件描述符，使用期间不会被关闭；系统不支持时返回None
+        描述符绑定的是目录本身而非路径，每次使用前校验路径当前指向的目录与描述符一致
+        """
+        if not self._use_dir_fd:
+            yield None
+            return
+        dir_st = os.stat(target_dir)
+        dir_id = (dir_st.st_dev, dir_st.st_ino)
+        with self._dir_fds_lock:
+            entry = self._dir_fds.get(target_dir)
+            if entry and entry[2] != dir_id:
+                # 目录已被重命名或重建，旧描述符指向的不再是该路径
+                self.__evict_dir_fd(target_dir, self._dir_fds.pop(target_dir))
+                entry = None
+            if entry:
+                self._dir_fds.move_to_end(target_dir)
+                entry[1] += 1
+        if not entry:
+            fd = os.open(target_dir, os.O_RDONLY | os.O_DIRECTORY)
+            fd_st = os.fstat(fd)
+            if (fd_st.st_dev, fd_st.st_ino) != dir_id:
+                os.close(fd)
+                raise FileNotFoundError(f"目录 {target_dir} 在打开过程中发生变化")
+            with self._dir_fds_lock:
+                entry = self._dir_fds.get(target_dir)
+                if entry and entry[2] == dir_id:
+                    # 其他线程已打开
+                    os.close(fd)
+                else:
+                    if entry:
+                        self.__evict_dir_fd(target_dir, self._dir_fds.pop(target_dir))
+                    entry = [fd, 0, dir_id]
+                    self._dir_fds[target_dir] = entry
+                    while len(self._dir_fds) > self._dir_fds_size:
+                        self.__evict_dir_fd(*self._dir_fds.popitem(last=False))
+                entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self._dir_fds_lock:
+                entry[1] -= 1
+                # 已移出缓存且无人使用时关闭
+                if entry[1] == 0 and self._dir_fds.get(target_dir) is not entry:
+                    os.close(entry[0])
+
+    @staticmethod
+    def __evict_dir_fd(target_dir: str, entry: list):
+        """
+        移出缓存的目录描述符，无人使用时立即关闭，否则由最后的使用者关闭，需持有_dir_fds_lock
+        """
+        if entry[1] == 0:
+            os.close(entry[0])
 
-    def __handle_delete(self, path: Path, mon_path: str):
+    @staticmethod
+    def _fast_copy(src: str, dst: Path):
+        """
+        复制文件内容、权限及修改时间，优先使用copy_file_range在内核中复制（支持的文件系统上为reflink），不支持时回退到普通复制
+        """
+        # 独占创建，目标已存在（包括软链接）时报错，避免写穿软链接
+        with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+            try:
+                if not hasattr(os, "copy_file_range"):
+                    raise OSError("copy_file_range not supported")
+                size = os.fstat(fsrc.fileno()).st_size
+                copied = 0
+                while True:
+                    sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30)
+                    if sent <= 0:
+                        break
+                    copied += sent
+                # 部分文件系统不报错但返回0，未复制完整时回退
+                if copied < size:
+                    raise OSError(f"copy_file_range copied {copied} of {size} bytes")
+            except OSError:
+                # 从当前偏移继续复制剩余内容
+                shutil.copyfileobj(fsrc, fdst, length=1 << 20)
+        shutil.copystat(src, dst)
+
+    def __ensure_dir(self, target_dir: Path):
+        """
+        创建目的目录，已创建过的目录直接跳过
+        """
+        key = str(target_dir)
+        with self._mkdir_lock:
+            if key in self._mkdir_cache:
+                self._mkdir_cache.move_to_end(key)
+                return
+        target_dir.mkdir(parents=True, exist_ok=True)
+        with self._mkdir_lock:
+            self._mkdir_cache[key] = None
+            if len(self._mkdir_cache) > self._mkdir_cache_size:
+                self._mkdir_cache.popitem(last=False)
+
+    def __invalidate_dirs(self, path: Path):
+        """
+        移除缓存中该路径及其子目录
+        """
+        key = str(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._mkdir_lock:
+            for d in [d for d in self._mkdir_cache if d == key or d.startswith(prefix)]:
+                del self._mkdir_cache[d]
+        with self._dir_fds_lock:
+            for d in [d for d in self._dir_fds if d == key or d.startswith(prefix)]:
+                self.__evict_dir_fd(d, self._dir_fds.pop(d))
+
+    def __file_lock(self, target_file: Path) -> threading.Lock:
+        """
+        获取目标文件对应的锁，无人持有时自动回收
+        """
+        key = str(target_file)
+        with self._file_locks_guard:
+            file_lock = self._file_locks.get(key)
+            if file_lock is None:
+                file_lock = threading.Lock()
+                self._file_locks[key] = file_lock
+            return file_lock
+
+    def __handle_delete(self, rel: str, target_path: Optional[Path]):
         """
         删除目标目录中的对应文件
+        :param rel: 源文件相对监控目录的路径
+        :param target_path: 目的目录
         """
-        relpath = Path(path).relative_to(mon_path)
-        for target_dir in self._dirconf.values():
-            if target_dir:
-                target_file = target_dir.joinpath(relpath)
-                if target_file.exists():
-                    target_file.unlink()
-                    logger.info(f"已删除文件 {target_file}")
+        if not target_path:
+            return
+        target_file = target_path.joinpath(rel)
+        self.__invalidate_dirs(target_file)
+        with self.__file_lock(target_file):
+            try:
+                target_file.unlink()
+                logger.info(f"已删除文件 {target_file}")
+            except FileNotFoundError:
+                pass
 
     def stop_service(self):
         """
         停止服务
         """
         self._event.set()
-        if self._scheduler:
-            self._scheduler.remove_all_jobs()
-            self._scheduler.shutdown()
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
         for observer in self._observer:
             observer.stop()
             observer.join()
         self._observer = []
+        if self._event_worker:
+            self._event_worker.join()
+            self._event_worker = None
+        self._event_queue = None
+        with self._dir_fds_lock:
+            while self._dir_fds:
+                self.__evict_dir_fd(*self._dir_fds.popitem(last=False))
 
     def get_state(self):
         pass